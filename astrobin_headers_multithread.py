@@ -2,11 +2,26 @@ import os
 import re
 import csv
 import sys
+import mmap
+import pickle
 import subprocess
-from collections import defaultdict
+from collections import Counter
 import concurrent.futures
 import threading
 
+# Use Google's RE2 (DFA based, linear time) for header scanning when installed
+# (pip install google-re2), otherwise fall back to the standard library.
+try:
+    import re2 as re_engine
+except ImportError:
+    re_engine = re
+
+# orjson parses WBPP log entries in C when installed; the stdlib json is the fallback.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 # ---------------------------------------------------------
 # CONFIGURATION
 # ---------------------------------------------------------
@@ -20,27 +35,57 @@ FILTER_MAP = {
     'S': 4420
 }
 
+# First-letter fallback for FILTER_MAP as a flat table indexed by ord(), so
+# names like 'Red' or 'Ha' resolve with one list index instead of a dict lookup.
+FILTER_LUT = [FILTER_MAP.get(chr(i)) for i in range(128)]
+
 # Pre-compile Regex Patterns for Speed
 # We store these globally so we don't rebuild them 5000 times.
+# Case-insensitivity is set inline with (?i) since RE2 takes no re.* flags.
 PATTERNS = {
     'xisf': {
-        'type': re.compile(r'<FITSKeyword\s+name="(?:IMAGETYP|TYPE)"\s+value="([^"]+)"', re.IGNORECASE),
-        'date': re.compile(r'<FITSKeyword\s+name="(?:DATE-LOC|DATE-OBS|DATE)"\s+value="([^"]+)"', re.IGNORECASE),
-        'filter': re.compile(r'<FITSKeyword\s+name="(?:FILTER|FILT)"\s+value="([^"]+)"', re.IGNORECASE),
-        'exposure': re.compile(r'<FITSKeyword\s+name="(?:EXPTIME|EXPOSURE)"\s+value="([^"]+)"', re.IGNORECASE),
-        'gain': re.compile(r'<FITSKeyword\s+name="(?:GAIN|ISO)"\s+value="([^"]+)"', re.IGNORECASE),
-        'binning': re.compile(r'<FITSKeyword\s+name="(?:XBINNING|BINNING)"\s+value="([^"]+)"', re.IGNORECASE),
+        'type': re_engine.compile(rb'(?i)<FITSKeyword\s+name="(?:IMAGETYP|TYPE)"\s+value="([^"]+)"'),
+        'combined': re_engine.compile(rb'(?i)<FITSKeyword\s+name="(?P<key>IMAGETYP|TYPE|DATE-LOC|DATE-OBS|DATE|FILTER|FILT|EXPTIME|EXPOSURE|GAIN|ISO|XBINNING|BINNING)"\s+value="([^"]+)"'),
     },
     'fits': {
-        'type': re.compile(r'(?:IMAGETYP|TYPE)\s*=\s*(?:\'([^\']*)\'|([0-9\.-]+))', re.IGNORECASE),
-        'date': re.compile(r'(?:DATE-LOC|DATE-OBS|DATE)\s*=\s*(?:\'([^\']*)\'|([0-9\.-]+))', re.IGNORECASE),
-        'filter': re.compile(r'(?:FILTER|FILT)\s*=\s*(?:\'([^\']*)\'|([0-9\.-]+))', re.IGNORECASE),
-        'exposure': re.compile(r'(?:EXPTIME|EXPOSURE)\s*=\s*(?:\'([^\']*)\'|([0-9\.-]+))', re.IGNORECASE),
-        'gain': re.compile(r'(?:GAIN|ISO)\s*=\s*(?:\'([^\']*)\'|([0-9\.-]+))', re.IGNORECASE),
-        'binning': re.compile(r'(?:XBINNING|BINNING)\s*=\s*(?:\'([^\']*)\'|([0-9\.-]+))', re.IGNORECASE),
+        'type': re_engine.compile(rb'(?i)(?:IMAGETYP|TYPE)\s*=\s*(?:\'([^\']*)\'|([0-9\.-]+))'),
+        'combined': re_engine.compile(rb'(?i)(?P<key>IMAGETYP|TYPE|DATE-LOC|DATE-OBS|DATE|FILTER|FILT|EXPTIME|EXPOSURE|GAIN|ISO|XBINNING|BINNING)\s*=\s*(?:\'([^\']*)\'|([0-9\.-]+))'),
     }
 }
 
+# Maps each keyword matched by the 'combined' patterns back to the field it fills.
+KEYWORD_FIELDS = {
+    b'IMAGETYP': 'type', b'TYPE': 'type',
+    b'DATE-LOC': 'date', b'DATE-OBS': 'date', b'DATE': 'date',
+    b'FILTER': 'filter', b'FILT': 'filter',
+    b'EXPTIME': 'exposure', b'EXPOSURE': 'exposure',
+    b'GAIN': 'gain', b'ISO': 'gain',
+    b'XBINNING': 'binning', b'BINNING': 'binning',
+}
+FIELD_COUNT = len(set(KEYWORD_FIELDS.values()))
+
+# Header bytes read per file: one 64KB block, so the kernel never fetches
+# a full block only for us to discard part of it.
+HEADER_CHUNK_SIZE = 65536
+
+# Most files handed to each worker per task. Workers count their batch locally so
+# only one Counter crosses the process boundary per batch instead of per file.
+# Smaller logs get smaller batches so every worker still has several tasks.
+BATCH_SIZE = 64
+BATCHES_PER_WORKER = 4
+
+# Parsed headers are cached across runs, keyed on path and validated by (mtime, size).
+# Bump _CACHE_VERSION whenever header parsing changes so old results are dropped.
+# Entries not seen in any of the last _CACHE_MAX_RUNS runs are evicted.
+_CACHE_PATH = os.path.expanduser('~/.astrobin_header_cache.pkl')
+_CACHE_VERSION = 2
+_CACHE_MAX_RUNS = 10
+
+# Registered file entries in WBPP logs look like: [true, "/path/to/file.xisf", ...]
+# The whole JSON string literal is captured (escapes included) so it can be
+# decoded exactly like an entry parsed as a full JSON array.
+LOG_PATH_PATTERN = re.compile(r'\[true,\s*("(?:[^"\\]|\\.)*")')
+
 # ---------------------------------------------------------
 # GUI / INPUT HELPERS
 # ---------------------------------------------------------
@@ -137,70 +182,287 @@ def extract_val(match):
     """Helper to extract clean value from regex match object."""
     if not match:
         return None
-    # FITS regex has two groups (quoted string OR number), XISF has one.
-    # We find the first non-None group.
-    val = next((g for g in match.groups() if g is not None), None)
+    # FITS regex has two value groups (quoted string OR number), XISF has one,
+    # and the 'combined' patterns also capture the keyword first.
+    # The value is always the last group that matched.
+    val = match.group(match.lastindex)
     if val:
-        return val.strip("'").strip('"')
+        # Only the short extracted value is decoded, never the whole header
+        return val.strip(b"'\"").decode('latin-1')
     return None
 
-def process_single_file(file_path):
+# O_NOATIME skips access-time updates (costly on network shares). Linux only
+# allows it for the file's owner, so it is dropped after the first refusal
+# rather than paying a failed open on every file we don't own.
+_use_noatime = hasattr(os, 'O_NOATIME')
+
+def open_readonly(file_path):
+    """Opens a raw read-only file descriptor, skipping atime updates where possible."""
+    global _use_noatime
+    flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+    if _use_noatime:
+        try:
+            return os.open(file_path, flags | os.O_NOATIME)
+        except PermissionError:
+            _use_noatime = False
+    return os.open(file_path, flags)
+
+def read_header(file_path, size):
+    """Reads the first `size` bytes of a file with one unbuffered read."""
+    fd = open_readonly(file_path)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            # One-shot read: hint the kernel not to keep these pages around
+            try:
+                os.posix_fadvise(fd, 0, size, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(fd, 0, size, os.POSIX_FADV_NOREUSE)
+            except OSError:
+                pass
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
+
+def trim_header(header_data, is_xisf):
+    """Cuts the raw read down to the header itself, dropping the image data after it."""
+    if is_xisf:
+        # XISF keeps all metadata in the leading XML block
+        end = header_data.find(b'</xisf>')
+        return header_data[:end + 7] if end >= 0 else header_data
+
+    # FITS headers stop at the END card (always on an 80-byte card boundary),
+    # padded out to a full 2880-byte block
+    end = header_data.find(b'END     ')
+    while end >= 0 and end % 80:
+        end = header_data.find(b'END     ', end + 1)
+    if end >= 0:
+        return header_data[:(end // 2880 + 1) * 2880]
+    return header_data
+
+def prefetch_headers(paths, size):
+    """Asks the kernel to start reading each file's header into the page cache."""
+    for path in paths:
+        try:
+            fd = open_readonly(path)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+def load_header_cache():
     """
-    Worker function to process exactly one file. 
-    Returns a tuple: (key_data, success_boolean)
+    Loads the header cache from disk, or an empty one if missing/stale.
+    Returns a tuple: (run_number, entries), entries mapping each path to
+    ((mtime, size), key_data, last_seen_run).
     """
-    if not os.path.exists(file_path):
-        return None
+    try:
+        with open(_CACHE_PATH, 'rb') as f:
+            data = pickle.load(f)
+        # Cached results hold mapped filter IDs, so a FILTER_MAP edit invalidates them
+        if data.get('version') == _CACHE_VERSION and data.get('filter_map') == FILTER_MAP:
+            return data['run'], data['entries']
+    except Exception:
+        pass
+    return 0, {}
 
-    header_chunk_size = 50000 
-    meta = {}
-    
+def save_header_cache(seen_paths):
+    """Evicts long-unseen entries from the header cache and atomically writes it back to disk."""
+    # Eviction works off run stamps alone, so it never touches the filesystem
+    # for cached files from other logs (each would be a round-trip on a NAS)
+    run = CACHE_RUN + 1
+    for path in seen_paths:
+        entry = HEADER_CACHE.get(path)
+        if entry:
+            HEADER_CACHE[path] = (entry[0], entry[1], run)
+    for path in [p for p, entry in HEADER_CACHE.items() if run - entry[2] >= _CACHE_MAX_RUNS]:
+        del HEADER_CACHE[path]
+
+    tmp_path = _CACHE_PATH + '.tmp'
     try:
-        is_xisf = file_path.lower().endswith('.xisf')
-        patterns = PATTERNS['xisf'] if is_xisf else PATTERNS['fits']
-
-        with open(file_path, 'rb') as f:
-            header_data = f.read(header_chunk_size)
-            header_text = header_data.decode('latin-1', errors='ignore')
-
-            # 1. Type (Fast check: if not LIGHT, abort immediately to save time)
-            match = patterns['type'].search(header_text)
-            val = extract_val(match)
-            if not val or 'LIGHT' not in val.upper():
-                return None
-
-            # 2. Extract remaining fields only if it's a LIGHT frame
-            # Filter
-            match = patterns['filter'].search(header_text)
-            raw_filter = extract_val(match) or 'Unknown'
-            
-            # Exposure
-            match = patterns['exposure'].search(header_text)
-            val = extract_val(match)
-            exposure = f"{float(val):.2f}" if val else "0"
+        with open(tmp_path, 'wb') as f:
+            data = {'version': _CACHE_VERSION, 'filter_map': FILTER_MAP, 'run': run, 'entries': HEADER_CACHE}
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, _CACHE_PATH)
+    except Exception as e:
+        print(f"Cache Warning: {e}")
+
+# Loaded at import so spawned worker processes get a copy too.
+CACHE_RUN, HEADER_CACHE = load_header_cache()
 
-            # Date
-            match = patterns['date'].search(header_text)
-            val = extract_val(match)
-            date = val.split('T')[0] if val else 'Unknown'
+def scan_header(file_path):
+    """
+    Parses one file's header.
+    Returns the CSV key tuple, or None if it is not a LIGHT frame.
+    """
+    meta = {}
 
-            # Gain
-            match = patterns['gain'].search(header_text)
-            val = extract_val(match)
-            gain = str(int(float(val))) if val else "0"
+    is_xisf = file_path.lower().endswith('.xisf')
+    patterns = PATTERNS['xisf'] if is_xisf else PATTERNS['fits']
 
-            # Binning
-            match = patterns['binning'].search(header_text)
-            val = extract_val(match)
-            binning = val if val else "1"
+    header_data = trim_header(read_header(file_path, HEADER_CHUNK_SIZE), is_xisf)
 
-            # Map Filter
-            filter_id = FILTER_MAP.get(raw_filter, FILTER_MAP.get(raw_filter[0], raw_filter))
+    # 1. Type (Fast check: if not LIGHT, abort immediately to save time)
+    # bytes.find is a C-level memmem, so locate the keyword literally and only
+    # run the regex on a small window around it. The full search is a fallback
+    # for headers where the literal isn't found (e.g. lowercase keywords).
+    match = None
+    idx = header_data.find(b'IMAGETYP')
+    if idx < 0:
+        idx = header_data.find(b'TYPE')
+    if idx >= 0:
+        # XISF puts '<FITSKeyword name="' in front of the keyword itself
+        match = patterns['type'].search(header_data, max(0, idx - 32), idx + 120)
+    if not match:
+        match = patterns['type'].search(header_data)
+    val = extract_val(match)
+    if not val or 'LIGHT' not in val.upper():
+        return None
+    meta['type'] = val
 
-            return (date, filter_id, exposure, binning, gain)
+    # 2. Extract remaining fields only if it's a LIGHT frame, in a single pass
+    # over the header keeping the first value seen for each field
+    for match in patterns['combined'].finditer(header_data):
+        # Group 1 is always the keyword (RE2 only accepts bytes names for bytes patterns)
+        field = KEYWORD_FIELDS[match.group(1).upper()]
+        if field in meta:
+            continue
+        meta[field] = extract_val(match)
+        if len(meta) == FIELD_COUNT:
+            break
 
-    except Exception:
+    # Filter
+    raw_filter = meta.get('filter') or 'Unknown'
+
+    # Exposure
+    val = meta.get('exposure')
+    exposure = f"{float(val):.2f}" if val else "0"
+
+    # Date
+    val = meta.get('date')
+    date = val.split('T')[0] if val else 'Unknown'
+
+    # Gain
+    val = meta.get('gain')
+    gain = str(int(float(val))) if val else "0"
+
+    # Binning
+    val = meta.get('binning')
+    binning = val if val else "1"
+
+    # Map Filter
+    first = ord(raw_filter[0])
+    filter_id = FILTER_MAP.get(raw_filter) or (FILTER_LUT[first] if first < 128 else None) or raw_filter
+
+    return (date, filter_id, exposure, binning, gain)
+
+def file_stamp(file_path):
+    """Returns the file's (mtime, size) for cache validation, or None if it can't be stat'ed."""
+    try:
+        # No separate exists() check: a missing file raises FileNotFoundError
+        # here and is skipped, saving a stat per file on network shares
+        st = os.stat(file_path)
+    except OSError:
         return None
+    return (st.st_mtime_ns, st.st_size)
+
+def is_cached(file_path, stamp):
+    """True if HEADER_CACHE holds a result for this exact version of the file."""
+    entry = HEADER_CACHE.get(file_path)
+    return entry is not None and entry[0] == stamp
+
+def process_single_file(file_path, stamp):
+    """
+    Worker function to process exactly one file. 
+    Returns a tuple: (key_data, success_boolean). key_data is None if it is
+    not a LIGHT frame; success is False if the file could not be read.
+    """
+    if is_cached(file_path, stamp):
+        return HEADER_CACHE[file_path][1], True
+    try:
+        return scan_header(file_path), True
+    except Exception:
+        return None, False
+
+def process_file_batch(paths):
+    """
+    Worker function to process a batch of files.
+    Returns a tuple: (counts, cache_updates). counts is a Counter of key_data
+    tuples; cache_updates maps each newly scanned path to (stamp, key_data).
+    """
+    counts = Counter()
+    cache_updates = {}
+    stamps = [file_stamp(file_path) for file_path in paths]
+
+    # Only cache misses get read. Ask the kernel to start fetching their headers
+    # now so disk/NAS readahead overlaps with parsing the files ahead of them.
+    misses = [p for p, stamp in zip(paths, stamps) if stamp and not is_cached(p, stamp)]
+    if misses and hasattr(os, 'posix_fadvise'):
+        prefetch_headers(misses, HEADER_CHUNK_SIZE)
+
+    for file_path, stamp in zip(paths, stamps):
+        if not stamp:
+            continue
+        result_key, success = process_single_file(file_path, stamp)
+        if success and not is_cached(file_path, stamp):
+            cache_updates[file_path] = (stamp, result_key)
+        if result_key:
+            counts[result_key] += 1
+    return counts, cache_updates
+
+def chunked(items, size):
+    """Yields consecutive slices of `items` with at most `size` entries."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def iter_entry_lines(mm):
+    """Yields only the log lines containing '[true', sliced straight out of the mapping."""
+    pos = mm.find(b'[true')
+    while pos >= 0:
+        start = mm.rfind(b'\n', 0, pos) + 1
+        end = mm.find(b'\n', pos)
+        if end < 0:
+            end = len(mm)
+        yield mm[start:end].decode('utf-8', errors='ignore')
+        pos = mm.find(b'[true', end)
+
+def decode_path_literal(literal):
+    """Decodes a quoted path from the log, keeping the raw text if it isn't strict JSON."""
+    try:
+        path = json_loads(literal)
+    except ValueError:
+        # e.g. unescaped C:\Users\... ('\U' is not a valid JSON escape)
+        return literal[1:-1]
+    # Unescaped paths like C:\night\frame.xisf decode '\n'/'\f' into control characters
+    if any(c < ' ' for c in path):
+        return literal[1:-1]
+    return path
+
+def parse_log_line(line):
+    """Returns the registered file paths found on one line of a WBPP log."""
+    if '[true' not in line:
+        return []
+
+    # Entries usually sit alone on a line as a JSON array: [true, "/path", ...],
+    entry = line.strip().rstrip(',')
+    if entry.startswith('[') and entry.endswith(']'):
+        try:
+            data = json_loads(entry)
+            if data[0] is True and isinstance(data[1], str) and not any(c < ' ' for c in data[1]):
+                return [data[1]] if data[1] else []
+        except (ValueError, IndexError, KeyError, TypeError):
+            pass
+
+    # Anything else (several entries per line, non-strict JSON) goes through the
+    # regex, decoding each path literal the same way so both routes agree
+    paths = []
+    for literal in LOG_PATH_PATTERN.findall(line):
+        path = decode_path_literal(literal)
+        if path:
+            paths.append(path)
+    return paths
 
 def process_log(log_path, bortle_val):
     if not log_path or not os.path.exists(log_path):
@@ -211,11 +473,16 @@ def process_log(log_path, bortle_val):
     
     valid_paths = []
     try:
-        with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-            # Simple regex to find paths in WBPP logs
-            matches = re.findall(r'\[true,\s*\"(.*?)\"', content)
-            valid_paths = list(set(matches))
+        # Map the log instead of reading it so large logs are never copied into memory
+        seen = set()
+        with open(log_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for line in iter_entry_lines(mm):
+                        seen.update(parse_log_line(line))
+        # Group paths by directory so each worker batch stays within one folder,
+        # keeping directory entries and metadata hot in the filesystem cache
+        valid_paths = sorted(seen, key=os.path.split)
     except Exception as e:
         show_message("Error", f"Could not read log:\n{e}", True)
         return
@@ -226,48 +493,55 @@ def process_log(log_path, bortle_val):
 
     print(f"Found {len(valid_paths)} potential files. Scanning headers in parallel...")
 
-    grouped_data = defaultdict(int)
-    count_processed = 0
+    grouped_data = Counter()
+    count_scanned = 0
+
+    # One process per core (Windows can't manage more than 61 worker processes)
+    workers = os.cpu_count() or 1
+    if sys.platform == 'win32':
+        workers = min(workers, 61)
+    batch_size = min(BATCH_SIZE, max(1, len(valid_paths) // (workers * BATCHES_PER_WORKER)))
+    batches = list(chunked(valid_paths, batch_size))
     
-    # MULTI-THREADING MAGIC HERE
-    # Max workers = 20 is usually a safe sweet spot for file I/O on Windows
-    with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        # Submit all tasks
-        futures = {executor.submit(process_single_file, path): path for path in valid_paths}
-        
-        for i, future in enumerate(concurrent.futures.as_completed(futures)):
-            result_key = future.result()
-            
-            if result_key:
-                grouped_data[result_key] += 1
-                count_processed += 1
-            
-            # Progress indicator every 50 files
-            if (i + 1) % 50 == 0:
-                print(f"Scanned {i + 1}/{len(valid_paths)} files...", end='\r')
+    # MULTI-PROCESSING MAGIC HERE
+    # Regex matching holds the GIL, so threads serialize on CPU. One process per
+    # core lets the header scans run truly in parallel. Paths go out in batches
+    # and come back as one Counter each to cut down on pickling/IPC overhead.
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(process_file_batch, batches)
+
+        for batch, (counts, cache_updates) in zip(batches, results):
+            grouped_data.update(counts)
+            # Keyed on path, so a re-stacked file replaces its stale entry
+            HEADER_CACHE.update(cache_updates)
+
+            # Progress indicator after every batch
+            count_scanned += len(batch)
+            print(f"Scanned {count_scanned}/{len(valid_paths)} files...", end='\r')
 
+    count_processed = sum(grouped_data.values())
     print(f"\nDone! Processed {count_processed} valid light frames.")
+    save_header_cache(set(valid_paths))
 
     output_dir = os.path.dirname(log_path)
     output_csv = os.path.join(output_dir, "astrobin_import.csv")
     
     try:
-        with open(output_csv, 'w', newline='') as csvfile:
+        with open(output_csv, 'w', newline='', buffering=1 << 20) as csvfile:
             fieldnames = ['date', 'filter', 'number', 'duration', 'binning', 'gain', 'bortle']
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             writer.writeheader()
             
-            for key in sorted(grouped_data.keys()):
-                date, flt_id, dur, binning, gain = key
-                writer.writerow({
-                    'date': date,
-                    'filter': flt_id,
-                    'number': grouped_data[key],
-                    'duration': dur,
-                    'binning': binning,
-                    'gain': gain,
-                    'bortle': bortle_val
-                })
+            # Key layout: (date, filter_id, duration, binning, gain)
+            writer.writerows({
+                'date': key[0],
+                'filter': key[1],
+                'number': grouped_data[key],
+                'duration': key[2],
+                'binning': key[3],
+                'gain': key[4],
+                'bortle': bortle_val
+            } for key in sorted(grouped_data))
         
         msg = f"Processed {count_processed} files.\nCSV saved to:\n{output_csv}"
         show_message("Success", msg)
@@ -277,7 +551,7 @@ def process_log(log_path, bortle_val):
 
 if __name__ == "__main__":
     # Windows/PyInstaller multiprocessing fix
-    # (Though we are using threads, this is good practice to include)
+    # (Required for the ProcessPoolExecutor workers to spawn correctly)
     import multiprocessing
     multiprocessing.freeze_support()
     